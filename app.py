@@ -7,8 +7,10 @@ Users can also provide feedback (like/dislike + optional comments) on each answe
 
 import streamlit as st
 from llm_answer_context import get_llm_answer
-from chat_memory import get_recent_memory, append_to_memory, update_feedback_to_memory
-from load_vector_store import load_index
+from chat_memory import get_recent_memory, get_memory_block, append_to_memory, update_feedback_to_memory
+from load_vector_store import load_index, QueryBatcher
+from embedding_utils import embed_query
+from semantic_cache import SemanticCache, is_follow_up
 import uuid
 
 # Load vector index and metadata
@@ -18,9 +20,26 @@ df_metadata, index = load_index("vector_index.faiss")
 st.set_page_config(page_title="Ask Marwin – Data Assistant", layout="wide")
 st.title("🧠 Hi..! I am Marwin: Your Personal Data Explorer..")
 
+# Answer cache for repeated / paraphrased stand-alone questions (one per server process, shared by all sessions, FIFO-bounded)
+@st.cache_resource
+def get_semantic_cache():
+    return SemanticCache(dim=index.d)
+
+semantic_cache = get_semantic_cache()
+
+# Searches from concurrent sessions are coalesced into one batched FAISS call
+@st.cache_resource
+def get_query_batcher():
+    return QueryBatcher(index)
+
+query_batcher = get_query_batcher()
+
+PAGE_SIZE = 20  # turns rendered per page; "Load more" reveals older ones
+
 # Custom CSS to fix input box at bottom and reverse message order
-st.markdown(
-     """
+@st.cache_data
+def page_css():
+    return """
     <style>
         body, .stApp {background-color: #0e0e11;}
    
@@ -29,55 +48,69 @@ st.markdown(
         .bubble-bot    {width:100%; float:left; padding:10px; border-radius:10px; margin:5px 0;}
         .feedback-buttons {display: flex; justify-content: flex-start; gap: 0.5rem; margin-top: 0.1rem; margin-bottom: 0.1rem;}
     </style>
-    """,
-    unsafe_allow_html=True)
+    """
+
+st.markdown(page_css(), unsafe_allow_html=True)
+
+
+# Feedback row for one answer. As a fragment, clicking 👍/👎 reruns only this row, not the whole chat.
+@st.fragment
+def feedback_row(turn):
+    st.markdown('<div class="feedback-buttons">', unsafe_allow_html=True)
+    col1, col2, col3, col4 = st.columns([0.05, 0.05, 0.05, 0.2])
+    query_key = turn['id']
+
+   
+    #Placeholder buttons
+    with col1:
+        st.button("Raise a Data Issue", key=f"data_issue_{query_key}")
+    
+    with col2:
+        st.button("Track Your Data Issue", key=f"track_data_issue_{query_key}")
+
+    with col3:
+        if st.button("👍", key=f"like_{query_key}"):
+            update_feedback_to_memory(turn["id"], "like")
+            st.toast("Thanks for your feedback!", icon="👍")
+
+    with col4:
+        dislike_clicked_key = f"dislike_clicked_{query_key}"
+        comment_key = f"comment_input_{query_key}"
+        comment_submitted_key = f"comment_submitted_{query_key}"
+
+        # 👎 Dislike button toggles comment box visibility
+        if st.button("👎", key=f"dislike_{query_key}"):
+            st.session_state[dislike_clicked_key] = True
+            st.session_state[comment_submitted_key] = False  # Reset submission status
+
+        # Show input box only if 👎 was clicked
+        if st.session_state.get(dislike_clicked_key):
+            comment = st.text_input("What could be better?", key=comment_key)
+            # If comment was typed and Enter is hit, save it
+            if comment:
+                update_feedback_to_memory(turn["id"], "dislike", comment)
+                st.toast("Feedback noted!", icon="👍")
+                st.session_state[comment_submitted_key] = True
+                st.session_state[dislike_clicked_key] = False  # Optionally reset to allow again
 
 # ────────────────────────── Chat window ──────────────────────────
 with st.container():
     st.markdown('<div class="message-container">', unsafe_allow_html=True)
 
+    # Only the newest turns are rendered; older ones on request
+    visible = st.session_state.setdefault("visible_turns", PAGE_SIZE)
+    history = get_recent_memory(visible + 1)  # one extra tells us whether older turns exist
+    if len(history) > visible:
+        history = history[1:]
+        if st.button("Load more", key="load_more"):
+            st.session_state["visible_turns"] = visible + PAGE_SIZE
+            st.rerun()
+
     # show past memory (oldest at top, newest at bottom)
-    for turn in get_recent_memory(50):
+    for turn in history:
         st.markdown(f"<div class='bubble-user'>{turn['query']}</div>", unsafe_allow_html=True)
         st.markdown(f"<div class='bubble-bot'>{turn['answer']}</div>", unsafe_allow_html=True)
-
-        st.markdown('<div class="feedback-buttons">', unsafe_allow_html=True)
-        col1, col2, col3, col4 = st.columns([0.05, 0.05, 0.05, 0.2])
-        query_key = turn['id']
-
-       
-        #Placeholder buttons
-        with col1:
-            st.button("Raise a Data Issue", key=f"data_issue_{query_key}")
-        
-        with col2:
-            st.button("Track Your Data Issue", key=f"track_data_issue_{query_key}")
-
-        with col3:
-            if st.button("👍", key=f"like_{query_key}"):
-                update_feedback_to_memory(turn["query"], turn["answer"], "like")
-                st.toast("Thanks for your feedback!", icon="👍")
-
-        with col4:
-            dislike_clicked_key = f"dislike_clicked_{query_key}"
-            comment_key = f"comment_input_{query_key}"
-            comment_submitted_key = f"comment_submitted_{query_key}"
-
-            # 👎 Dislike button toggles comment box visibility
-            if st.button("👎", key=f"dislike_{query_key}"):
-                st.session_state[dislike_clicked_key] = True
-                st.session_state[comment_submitted_key] = False  # Reset submission status
-
-            # Show input box only if 👎 was clicked
-            if st.session_state.get(dislike_clicked_key):
-                comment = st.text_input("What could be better?", key=comment_key)
-                # If comment was typed and Enter is hit, save it
-                if comment:
-                    update_feedback_to_memory(turn["query"], turn["answer"], "dislike", comment)
-                    st.toast("Feedback noted!", icon="👍")
-                    st.session_state[comment_submitted_key] = True
-                    st.session_state[dislike_clicked_key] = False  # Optionally reset to allow again
-        
+        feedback_row(turn)
         st.divider()
 
     st.markdown('</div>', unsafe_allow_html=True)
@@ -88,11 +121,23 @@ user_query = st.chat_input("How can I help you with Your Data Query Today..?")
 
 if user_query:
     # Generate LLM answer with context
-    # Recent turns for context
-    recent_mem = get_recent_memory(6)
+    # Recent turns for context, in fixed blocks of 6 so the prompt prefix stays cacheable
+    recent_mem = get_memory_block(6)
     
-    # Generate answer (also returns top_matches for memory logging)
-    answer, top_matches = get_llm_answer(user_query, df_metadata, index, memory=recent_mem)
+    # Embed once (memoized per query string): the same vector serves the answer cache and the FAISS search
+    q_vec = embed_query(user_query)
+
+    # Near-identical stand-alone question answered before → skip the LLM call.
+    # Follow-ups depend on this conversation's history, so they never read from or write to the cache.
+    use_cache = not is_follow_up(user_query)
+    cached = semantic_cache.lookup(q_vec) if use_cache else None
+    if cached is not None:
+        answer, top_matches = cached
+    else:
+        # Generate answer (also returns top_matches for memory logging)
+        answer, top_matches = get_llm_answer(user_query, df_metadata, query_batcher, memory=recent_mem, q_vec=q_vec)
+        if use_cache:
+            semantic_cache.add(q_vec, answer, top_matches)
     append_to_memory(user_query, answer, top_matches=top_matches)
     st.rerun()   # Rerun so new message appears
 
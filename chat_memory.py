@@ -1,86 +1,184 @@
-# chat_memory.py – Simple JSON‑file conversation memory for Marwin
+# chat_memory.py – Simple append‑only JSONL conversation memory for Marwin
 """
 Purpose (layman‑friendly)
 =========================
 This module lets Marwin **remember past questions and answers** between a user and the RAG assistant.
-Instead of a database we start with a lightweight **JSON file** that stores each turn like this:
+Instead of a database we start with a lightweight **JSON Lines file**: one JSON object per line,
+and new turns are only ever *appended* (no rewriting the whole history on every message):
 
 ```jsonc
-[
-  {
-    "id": "8e2a6e2e-37c1-4d3f-b51e-c8e8dbe74f1f",
-    "user_id": "843920",
-    "timestamp": "2025-07-02T10:15:00Z",
-    "query": "Where can I find application approvals?",
-    "answer": "Use fact_applications.outcome_id…"
-  },
-  {
-    "id": "bb2e2b2b-74f4-4a3e-a857-b6a8f00cd05e",
-    "user_id": "843920",
-    "timestamp": "2025-07-02T10:16:30Z",
-    "query": "What about rejections?",
-    "answer": "Use the same table, outcome_id = 'D'…"
-  }
-]
+{"id": "8e2a6e2e-37c1-4d3f-b51e-c8e8dbe74f1f", "user_id": "843920", "timestamp": "2025-07-02T10:15:00Z", "query": "Where can I find application approvals?", "answer": "Use fact_applications.outcome_id…"}
+{"id": "bb2e2b2b-74f4-4a3e-a857-b6a8f00cd05e", "user_id": "843920", "timestamp": "2025-07-02T10:16:30Z", "query": "What about rejections?", "answer": "Use the same table, outcome_id = 'D'…"}
+{"override": "8e2a6e2e-37c1-4d3f-b51e-c8e8dbe74f1f", "fields": {"feedback_type": "like", "comment": null}}
 ```
 
+Feedback is stored as an **override line** pointing at the turn's `id`; readers merge it into that turn.
+An in‑process `id → byte offset` index lets feedback find its turn with one `seek` instead of a full scan.
+
 Core Functions
 --------------
 1. **load_memory(file_path)**
-   • Loads the JSON list into Python (returns `list[dict]`).
+   • Loads every turn (overrides applied) into Python (returns `list[dict]`).
    • Returns an empty list if file doesn’t exist.
 
 2. **append_to_memory(query, answer, file_path)**
-   • Adds a new `{id, user_id, timestamp, query, answer}` dict to memory and saves JSON.
+   • Appends a new `{id, user_id, timestamp, query, answer}` line – O(1) per turn.
 
 3. **get_recent_memory(n, file_path)**
-   • Returns the *n* most recent turns (default 5) for prompt context.
+   • Returns the *n* most recent turns (default 10), e.g. for the chat window, reading only the file tail.
+
+4. **get_memory_block(block_size, file_path)**
+   • History for the LLM prompt, paged in fixed blocks so the prompt prefix stays cacheable
+     (only bytes appended since the last call are scanned; the block itself is one read).
 
-4. **clear_memory(file_path)**
-   • Wipes the JSON file (useful for a "Reset conversation" button).
+5. **clear_memory(file_path)**
+   • Wipes the file (useful for a "Reset conversation" button).
+
+6. **migrate_json_memory(json_path, file_path)**
+   • One‑off conversion of the old single‑JSON‑array `chat_memory.json` into JSONL.
 """
 
 import json
 import os
+import threading
 import uuid
 from datetime import datetime, timezone
-from typing import List, Dict
+from typing import Dict, Iterator, List, Tuple
+
+import orjson
 
-MEMORY_FILE = "chat_memory.json"  # default path; override per‑user in future
+MEMORY_FILE = "chat_memory.jsonl"  # default path; override per‑user in future
 DEFAULT_USER_ID = "843920"         # temp user id placeholder
+TAIL_BLOCK_SIZE = 64 * 1024        # bytes read per step when scanning the file backwards
+
+_offsets: Dict[str, Dict[str, int]] = {}  # abs file path → {turn id → byte offset of its line}
+_turn_lines: Dict[str, Tuple[int, List[int]]] = {}  # abs file path → (bytes scanned, offsets of turn lines in order)
+_turn_lines_lock = threading.Lock()  # Streamlit sessions share the module from several threads
 
 # -----------------------------------------------------------------------------
-# Helper: safe file read/write
+# Helper: safe file read/append
 # -----------------------------------------------------------------------------
 
-def read_json(path: str) -> List[Dict]:
+def _parse(line: bytes):
+    try:
+        return orjson.loads(line)
+    except orjson.JSONDecodeError:
+        return None  # corrupt / half‑written line → skip it
+
+def iter_jsonl(path: str) -> Iterator[Dict]:
+    """Yield records oldest → newest."""
     if not os.path.exists(path):
-        return []
-    with open(path, "r", encoding="utf‑8") as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return []  # corrupt or empty file → start fresh
+        return
+    with open(path, "rb") as f:
+        for line in f:
+            record = _parse(line)
+            if record is not None:
+                yield record
+
+def iter_jsonl_reversed(path: str, block_size: int = TAIL_BLOCK_SIZE) -> Iterator[Dict]:
+    """Yield records newest → oldest, reading the file backwards in blocks."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        tail = b""
+        while pos > 0:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            lines = (f.read(step) + tail).split(b"\n")
+            tail = lines.pop(0)  # may be cut mid‑line; finish it with the next block
+            for line in reversed(lines):
+                record = _parse(line) if line.strip() else None
+                if record is not None:
+                    yield record
+        if tail.strip():
+            record = _parse(tail)
+            if record is not None:
+                yield record
+
+def append_jsonl(path: str, record: Dict):
+    line = orjson.dumps(record, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n"
+    with open(path, "ab", buffering=0) as f:  # unbuffered: the line goes out in one O_APPEND write
+        f.write(line)
+        # Measure *after* the write: O_APPEND places the line at the true end of file even if another
+        # process appended in between, and our own fd position ends right after our line.
+        offset = f.tell() - len(line)
+    index = _offsets.get(os.path.abspath(path))
+    if index is not None and "id" in record:
+        index[record["id"]] = offset
+
+def offset_index(path: str, refresh: bool = False) -> Dict[str, int]:
+    """Map turn id → byte offset of its line; built with one scan, then kept up to date by append_jsonl."""
+    key = os.path.abspath(path)
+    if refresh or key not in _offsets:
+        index = {}
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                offset = 0
+                for line in f:
+                    record = _parse(line)
+                    if record is not None and "id" in record:
+                        index[record["id"]] = offset
+                    offset += len(line)
+        _offsets[key] = index
+    return _offsets[key]
+
+def turn_line_offsets(path: str) -> Tuple[int, List[int]]:
+    """
+    Byte offsets of every turn line (not override lines) in file order, plus how many bytes were scanned.
+    Read from the file itself, so turns appended by other processes are counted too; only the bytes
+    added since the last call are scanned. The returned list is shared, so don't modify it.
+    """
+    key = os.path.abspath(path)
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    with _turn_lines_lock:
+        scanned, offsets = _turn_lines.get(key, (0, []))
+        if size < scanned:  # file was cleared / replaced → start over
+            scanned, offsets = 0, []
+        if size > scanned:
+            with open(path, "rb") as f:
+                f.seek(scanned)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # half‑written last line: count it on a later call
+                    record = _parse(line)
+                    if record is not None and "id" in record:
+                        offsets.append(scanned)
+                    scanned += len(line)
+        _turn_lines[key] = (scanned, offsets)
+        return scanned, offsets
 
-def write_json(path: str, data: List[Dict]):
-    with open(path, "w", encoding="utf‑8") as f:
-        json.dump(data, f, indent=2)
+def read_record_at(path: str, offset: int):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return _parse(f.readline())
+
+def read_jsonl(path: str) -> List[Dict]:
+    """All turns in order, with override lines merged into the turn they point at."""
+    turns = {}
+    for record in iter_jsonl(path):
+        if "override" in record:
+            if record["override"] in turns:
+                turns[record["override"]].update(record["fields"])
+        else:
+            turns[record["id"]] = record
+    return list(turns.values())
 
 # -----------------------------------------------------------------------------
 # Public API
 # -----------------------------------------------------------------------------
 
 def load_memory(file_path: str = MEMORY_FILE) -> List[Dict]:
-    """Load entire chat history from JSON. Empty list if none."""
-    return read_json(file_path)
+    """Load entire chat history from JSONL. Empty list if none."""
+    return read_jsonl(file_path)
 
 
 def append_to_memory(query: str, answer: str, top_matches: List[Dict], file_path: str = MEMORY_FILE):
     """
     Add a new memory entry including query, response, top vector matches, and metadata.
     """
-    memory = read_json(file_path)
-    memory.append({
+    append_jsonl(file_path, {
         "id": str(uuid.uuid4()),
         "user_id": "823471",  # replace with real user ID logic later
         "timestamp": datetime.now().isoformat(),
@@ -90,57 +188,107 @@ def append_to_memory(query: str, answer: str, top_matches: List[Dict], file_path
         "feedback_type": None,  # 🛠️ Default placeholders
         "comment": None         # 🛠️ Default placeholders        
     })
-    write_json(file_path, memory)
     
 #-----------------------------------------------
 
 def get_recent_memory(n: int = 10, file_path: str = MEMORY_FILE) -> List[Dict]:
     """Return the *n* most recent turns for prompt context."""
-    history = read_json(file_path)
-    return history[-n:]
+    if n <= 0:
+        return []
+    recent, overrides = [], {}
+    for record in iter_jsonl_reversed(file_path):
+        if "override" in record:
+            # newest → oldest, so keep stacking; applied oldest‑first below
+            overrides.setdefault(record["override"], []).append(record["fields"])
+            continue
+        for fields in reversed(overrides.pop(record["id"], [])):
+            record.update(fields)
+        recent.append(record)
+        if len(recent) == n:
+            break
+    return recent[::-1]
     
 #-----------------------------------------
 
+def get_memory_block(block_size: int = 6, file_path: str = MEMORY_FILE) -> List[Dict]:
+    """
+    Return history for the prompt in fixed blocks: the turns since the start of the previous
+    *block_size*‑aligned block (between block_size and 2·block_size − 1 turns, fewer early on).
+    Unlike a sliding window the first turn only moves every *block_size* turns, so consecutive
+    prompts share instructions + history as a prefix and OpenAI can serve it from its prompt cache.
+    Turns are counted from the file itself, so those written by other worker processes are included.
+    """
+    end, offsets = turn_line_offsets(file_path)
+    if not offsets:
+        return []
+    first = offsets[max(0, block_size * (len(offsets) // block_size) - block_size)]
+    with open(file_path, "rb") as f:  # one read covering the block (and any feedback lines inside it)
+        f.seek(first)
+        lines = f.read(end - first).splitlines()
+    turns = {}
+    for record in filter(None, map(_parse, lines)):
+        if "override" in record:
+            if record["override"] in turns:
+                turns[record["override"]].update(record["fields"])
+        else:
+            turns[record["id"]] = record
+    return list(turns.values())
+
+#-----------------------------------------
+
 def clear_memory(file_path: str = MEMORY_FILE):
     """Delete all stored conversation turns (reset)."""
-    write_json(file_path, [])
+    open(file_path, "wb").close()
+    _offsets.pop(os.path.abspath(file_path), None)
+    with _turn_lines_lock:
+        _turn_lines.pop(os.path.abspath(file_path), None)
     print("🗑️  Chat memory cleared.")
     
 #----------------------------------------------------------------------------------
 
 def update_feedback_to_memory(
-    query: str,
-    answer: str,
+    entry_id: str,
     feedback_type: str,
     comment: str = None,
     file_path: str = MEMORY_FILE
 ):
     """
-    Locate the memory record using query and answer, and update it with feedback type and optional comment.
+    Locate the memory record by its id, and update it with feedback type and optional comment.
 
     Args:
-        query (str): The user's original question
-        answer (str): The LLM-generated answer
+        entry_id (str): The `id` of the memory entry (as returned by get_recent_memory)
         feedback_type (str): 'like' or 'dislike'
         comment (str, optional): Optional feedback comment from user
-        file_path (str): Path to the chat memory JSON
+        file_path (str): Path to the chat memory JSONL
     """
-    memory = read_json(file_path)
-    updated = False
-
-    for item in memory:
-        if item.get("query") == query and item.get("answer") == answer:
-            item["feedback_type"] = feedback_type
-            item["comment"] = comment
-            updated = True
-            break
+    turn = None
+    for refresh in (False, True):  # second pass rescans: id appended elsewhere or offset stale
+        offsets = offset_index(file_path, refresh=refresh)
+        if entry_id in offsets:
+            turn = read_record_at(file_path, offsets[entry_id])
+            if turn is not None and turn.get("id") == entry_id:
+                break
+        turn = None
 
-    if updated:
-        write_json(file_path, memory)
-        print(f"✅ Feedback updated for: {query}")
+    if turn is not None:
+        append_jsonl(file_path, {
+            "override": entry_id,
+            "fields": {"feedback_type": feedback_type, "comment": comment},
+        })
+        print(f"✅ Feedback updated for: {turn['query']}")
     else:
         print("⚠️ No matching record found to update feedback.")
 
+#----------------------------------------------------------------------------------
+
+def migrate_json_memory(json_path: str = "chat_memory.json", file_path: str = MEMORY_FILE):
+    """Convert the old JSON‑array memory file into JSONL (appends, keeps the original)."""
+    with open(json_path, "r", encoding="utf‑8") as f:
+        history = json.load(f)  # stdlib json: tolerates the NaN values older files contain
+    for item in history:
+        append_jsonl(file_path, item)
+    print(f"📦 Migrated {len(history)} turns from {json_path} to {file_path}")
+
 
 # -----------------------------------------------------------------------------
 # Self‑test (only runs if you execute python chat_memory.py)
@@ -1,29 +1,70 @@
 # embedding_utils.py – Vectorize metadata and enable search using semantic similarity
 """
-This file handles two key tasks:
+This file handles three key tasks:
 1. embed(texts): Converts a list of descriptive metadata strings (from the 'doc' column) into vector embeddings using OpenAI's embedding model. These embeddings represent the meaning of text in a way machines can understand.
-2. search(query, k=5): Takes a user query, embeds it the same way, and compares it to the stored metadata vectors using vector similarity. Returns the most semantically similar metadata entries.
+2. embed_query(text): Embeds a single user query (unit length, ready for the cosine index), memoized so a repeated question never pays a second OpenAI round-trip.
+3. search(query, k=5): Takes a user query, embeds it the same way, and compares it to the stored metadata vectors using vector similarity. Returns the most semantically similar metadata entries.
 
 These utilities power the semantic search experience in our metadata assistant.
 """
 
 import streamlit as st
 import os
+import time
+import functools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import httpx
 import openai
 from dotenv import load_dotenv
 
 # Load your OpenAI API key from environment variable
 load_dotenv()
 
-#openai.api_key = os.getenv("OPENAI_API_KEY")
-openai.api_key = st.secrets["OPENAI_API_KEY"]
+# One client (and connection pool) for the whole process: keep-alive skips a TLS handshake per request,
+# and HTTP/2 multiplexes the concurrent embedding batches over a single connection.
+client = openai.OpenAI(
+    #api_key=os.getenv("OPENAI_API_KEY"),
+    api_key=st.secrets["OPENAI_API_KEY"],
+    max_retries=0,  # _embed_one owns the retry/backoff policy for embeddings; SDK retries would multiply it
+    http_client=openai.DefaultHttpxClient(
+        limits=httpx.Limits(max_connections=16, max_keepalive_connections=16),
+        http2=True,
+    ),
+)
 
 model = "text-embedding-3-small"  # cheap & fast embedding model
+MAX_WORKERS = 8   # concurrent embedding requests (the work is network-bound, not CPU-bound)
+MAX_RETRIES = 5   # attempts per batch on rate limits and transient failures
+
+# Errors worth retrying (as the SDK's own retries would): 429, 409, 5xx, dropped connections and timeouts
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,  # also covers APITimeoutError
+    openai.ConflictError,
+    openai.InternalServerError,
+)
+
+def _embed_one(batch):
+    """Embed one batch, backing off exponentially (1s, 2s, 4s, ...) on rate limits and transient errors."""
+    for attempt in range(MAX_RETRIES):
+        try:
+            response = client.embeddings.create(
+                model=model,
+                input=batch
+            )
+            return [item.embedding for item in response.data]
+        except RETRYABLE_ERRORS:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            time.sleep(2 ** attempt)
+
 
 def embed(texts, batch_size=50):
     """
     Convert a list of text strings into vector embeddings using OpenAI API.
+    Batches are sent concurrently (up to MAX_WORKERS in flight); results keep the input order.
 
     Args:
         texts (list): List of strings to embed.
@@ -32,17 +73,72 @@ def embed(texts, batch_size=50):
     Returns:
         np.ndarray: 2D array of embeddings.
     """
-    vectors = []
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i: i + batch_size]
-        response = openai.embeddings.create(
-            model=model,
-            input=batch
-        )
-        batch_vecs = [item.embedding for item in response.data]
-        vectors.extend(batch_vecs)
+    batches = [texts[i: i + batch_size] for i in range(0, len(texts), batch_size)]
+    if len(batches) <= 1:
+        batch_vecs = [_embed_one(batch) for batch in batches]  # single query: skip the thread pool
+    else:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+            batch_vecs = list(pool.map(_embed_one, batches))  # map() yields in submission order
+    vectors = [vec for batch in batch_vecs for vec in batch]
     return np.array(vectors, dtype="float32")
 
+
+@functools.lru_cache(maxsize=1024)
+def embed_query(text):
+    """
+    Embed one query string, L2-normalized once here and cached per process.
+
+    Returns:
+        np.ndarray: 1D read-only unit-length float32 embedding (shared between callers, so never modify it in place).
+    """
+    vec = normalize(embed([text]))[0]
+    vec.setflags(write=False)
+    return vec
+
+
+def normalize(vectors):
+    """
+    Scale each row to unit length so inner-product search behaves like cosine similarity.
+
+    Args:
+        vectors (np.ndarray): 1D or 2D array of embeddings.
+
+    Returns:
+        np.ndarray: 2D float32 array with unit-norm rows.
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype="float32"))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def as_query_batch(q_vecs):
+    """
+    View unit-length query vector(s) (e.g. from embed_query) as the contiguous (n, d) float32
+    matrix `index.search` expects. A reshape view, not a copy, when the input is already float32.
+    """
+    return np.ascontiguousarray(q_vecs, dtype="float32").reshape(-1, np.shape(q_vecs)[-1])
+
+
+RESULT_COLUMNS = ("doc", "TABLE_NAME", "COLUMN_NAME")
+_arrays_cache = {}  # id(df_metadata) → (weakref to df_metadata, {column: np.ndarray}); dropped with the frame
+
+def metadata_arrays(df_metadata):
+    """
+    Object-dtype numpy arrays of RESULT_COLUMNS, computed once per DataFrame, so search results
+    are gathered with one fancy-index instead of a fresh column copy (or .iloc lookups) per query.
+    Only a weak reference to the frame is kept: its entry is removed when the frame is garbage collected.
+
+    Returns:
+        dict[str, np.ndarray]: column name → array, shared between callers (never modify it in place).
+    """
+    key = id(df_metadata)
+    cached = _arrays_cache.get(key)
+    if cached is None or cached[0]() is not df_metadata:
+        arrays = {col: df_metadata[col].to_numpy(dtype=object) for col in RESULT_COLUMNS}
+        cached = _arrays_cache[key] = (weakref.ref(df_metadata), arrays)
+        weakref.finalize(df_metadata, _arrays_cache.pop, key, None)
+    return cached[1]
+
 #----------------------------
 
 """
@@ -59,19 +155,18 @@ def search(query, df_metadata, index, k=5):
         k (int): Number of top results to return.
 
     Returns:
-        list[dict]: Top matching entries with metadata and distance scores.
+        dict[str, list]: Columns "distance", "doc", "table", "column" – entry i of each list is the i-th best match.
     """
-    q_vec = embed([query])[0]          # get embedding for the query
-    D, I = index.search(np.array([q_vec]), k)   # find closest vectors and store the found results
-    results = []
-    for dist, idx in zip(D[0], I[0]):
-        results.append({
-            "distance": float(dist),
-            "doc": df_metadata["doc"].iloc[idx],
-            "table": df_metadata["TABLE_NAME"].iloc[idx],
-            "column": df_metadata["COLUMN_NAME"].iloc[idx],
-        })
-    return results
-
+    q_vec = embed_query(query)         # get embedding for the query
+    D, I = index.search(as_query_batch(q_vec), k)   # find closest vectors and store the found results
+    found = I[0] >= 0                  # FAISS pads with -1 when fewer than k hits exist
+    ids = I[0][found]
+    arrays = metadata_arrays(df_metadata)  # cached per DataFrame, not rebuilt per query
+    return {
+        "distance": D[0][found].tolist(),
+        "doc": arrays["doc"][ids].tolist(),
+        "table": arrays["TABLE_NAME"][ids].tolist(),
+        "column": arrays["COLUMN_NAME"][ids].tolist(),
+    }
 
 
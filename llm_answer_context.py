@@ -2,14 +2,21 @@
 """
 Functions
 ---------
-get_llm_answer(query, df_metadata, index, memory=None)
+get_llm_answer(query, df_metadata, index, memory=None, q_vec=None)
     → Returns a natural language answer generated by LLM using context from vector DB + prior memory.
     → Also returns the top 5 match records (with score) used for evaluation/logging.
+
+build_messages(query, context_chunks, memory=None)
+    → Chat messages ordered for prompt caching: static instructions, past turns, then context + question.
+
+prompt_cache_key(memory=None)
+    → OpenAI prompt-cache routing key; changes only when the history block (see chat_memory.get_memory_block) rolls over.
 """
 import streamlit as st
 import os
+import hashlib
 import openai
-from embedding_utils import embed
+from embedding_utils import client, embed, embed_query, as_query_batch
 import numpy as np
 from dotenv import load_dotenv
 
@@ -24,32 +31,10 @@ model = "gpt-4o-mini"
 
 
 # ───────────────────────────── Build Prompt ─────────────────────────────
-def build_prompt(query, context_chunks, memory=None):
-    """
-    Compose a prompt for OpenAI LLM using past memory + top match metadata-rich context.
-    """
-    context_block = "\n\n".join(
-        f"[{i+1}] Schema: {row.get('schema', '')} | "
-        f"Database: {row.get('database', '')} | "
-        f"Database Description: {row.get('database_description', '')} | "
-        f"Table: {row.get('table', '')} | "
-        f"Table Description: {row.get('table_comment', '')} | "
-        f"Column: {row.get('column', '')} | "
-        f"Column Description: {row.get('column_comment', '')} | "
-        f"Column Type: {row.get('data_type', '')} ({row.get('column_type', '')}) | "
-        f"Column Nullable: {row.get('nullable', '')}, "
-        f"Column Key: {row.get('key', '')}, "
-        f"Column Length: {row.get('length', 'N/A')} | "
-        f"Similarity score: {row.get('distance', 0.0):.4f}"
-        for i, row in enumerate(context_chunks)
-    )
-
-    history_block = ""
-    if memory:
-        for turn in memory:
-            history_block += f"User: {turn['query']}\nMarwin: {turn['answer']}\n"
-
-    prompt = f"""
+# Static instructions go first, then a fixed block of history; together they usually pass the
+# 1024-token minimum for OpenAI's prompt cache, so they aren't re-processed on every request.
+# The per-query parts follow after.
+INSTRUCTIONS = """
             You are Marwin, a helpful assistant who helps data analysts find metadata.
             
             For your reference, here is a sample schema strcuture that you would find in the metadata vector embeddings:
@@ -71,38 +56,80 @@ def build_prompt(query, context_chunks, memory=None):
 
             If a user asks about databases, tables or columns OR if they come to you searching for databases, tables or columns, please use the folliwng details from the embeddings schema name or                     database name, schema description or database description, table name, table description, column name, column description.
             Example: A user asks "How many databases are there? you should look up the above embeddings and answer something like "There are X number of databases and their names are XX                               and here are their descriptions or here is what they store"
-          
-            
+""".strip()
+
+
+
+def prompt_cache_key(memory=None):
+    """
+    Routing key for OpenAI's prompt cache: model + instructions + first history turn.
+    History comes in fixed blocks (chat_memory.get_memory_block), so the key only changes when
+    the block rolls over and requests sharing a prefix land on the same cache.
+    """
+    first_turn = memory[0]["id"] if memory else ""
+    return hashlib.blake2b(f"{model}\n{INSTRUCTIONS}\n{first_turn}".encode(), digest_size=16).hexdigest()
+
+
+def build_messages(query, context_chunks, memory=None):
+    """
+    Compose chat messages for OpenAI LLM: fixed instructions, then past memory turns,
+    then the top match metadata-rich context with the new question.
+    Ordering from most to least stable keeps the longest possible prefix cacheable.
+    """
+    context_block = "\n\n".join(
+        f"[{i+1}] Schema: {row.get('schema', '')} | "
+        f"Database: {row.get('database', '')} | "
+        f"Database Description: {row.get('database_description', '')} | "
+        f"Table: {row.get('table', '')} | "
+        f"Table Description: {row.get('table_comment', '')} | "
+        f"Column: {row.get('column', '')} | "
+        f"Column Description: {row.get('column_comment', '')} | "
+        f"Column Type: {row.get('data_type', '')} ({row.get('column_type', '')}) | "
+        f"Column Nullable: {row.get('nullable', '')}, "
+        f"Column Key: {row.get('key', '')}, "
+        f"Column Length: {row.get('length', 'N/A')} | "
+        f"Similarity score: {row.get('distance', 0.0):.4f}"
+        for i, row in enumerate(context_chunks)
+    )
+
+    messages = [{"role": "system", "content": INSTRUCTIONS}]
+    if memory:
+        for turn in memory:
+            messages.append({"role": "user", "content": turn["query"]})
+            messages.append({"role": "assistant", "content": turn["answer"]})
+
+    messages.append({"role": "user", "content": f"""
             Below is the context you can refer to:
 
             {context_block}
 
-            {history_block}
             User: {query}
-            Marwin:"""
-    
-    return prompt.strip()
+            Marwin:""".strip()})
+    return messages
 
 #---------------------------------------------------------
 
-def get_llm_answer(query, df_metadata, index, memory):
+def get_llm_answer(query, df_metadata, index, memory, q_vec=None):
     """
     Embeds query, retrieves top matches, builds prompt with memory, and sends to LLM.
+    `index` is a FAISS index or anything with the same `.search(x, k)` (e.g. load_vector_store.QueryBatcher).
+    Pass `q_vec` (from embed_query) if the caller already embedded the query (e.g. for the semantic cache).
     Returns:
         answer (str): Natural language answer
         top_matches (List[Dict]): top-5 context matches (with distance scores and metadata)
     """
-    # Embed user query
-    q_vec = embed([query])[0]
-
-    # Vector search for top matches
-    D, I = index.search(np.array([q_vec]), k=5)
+    # Embed user query (unless already done by the caller)
+    if q_vec is None:
+        q_vec = embed_query(query)
+
+    # Vector search for top matches (embed_query output is already unit length, matching the cosine index)
+    D, I = index.search(as_query_batch(q_vec), k=5)
+    found = I[0] >= 0  # FAISS pads with -1 when fewer than k hits exist
+    rows = df_metadata.iloc[I[0][found]].to_dict("records")  # one gather instead of k .iloc calls
     top_matches = []
-    for dist, idx in zip(D[0], I[0]):
-        row = df_metadata.iloc[idx]
-        
+    for dist, row in zip(D[0][found].tolist(), rows):
         top_matches.append({
-            "distance": float(dist),
+            "distance": dist,
             "doc": row["doc"],
             
             "schema": row.get("FULL_SCHEMA", ""),
@@ -120,15 +147,14 @@ def get_llm_answer(query, df_metadata, index, memory):
         })
 
     # Prompt with matches + memory
-    prompt = build_prompt(query, top_matches, memory=memory)
+    messages = build_messages(query, top_matches, memory=memory)
 
-    # Query OpenAI
-    response = openai.chat.completions.create(
+    # Query OpenAI over the shared pooled client (same cache key for every request sharing the instruction + history prefix).
+    # The shared client has SDK retries off for embed(); chat keeps the SDK's default 2 retries.
+    response = client.with_options(max_retries=2).chat.completions.create(
         model=model,
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt},
-        ]
+        messages=messages,
+        extra_body={"prompt_cache_key": prompt_cache_key(memory)},
     )
 
     return response.choices[0].message.content.strip(), top_matches
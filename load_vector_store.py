@@ -10,67 +10,205 @@ system is ready to answer queries instantly.
 What the functions do
 ---------------------
 1. **load_index(filepath)**
-   • Opens the pickle file created by `vector_store.save_index()`.
-   • Returns three objects:
+   • Memory‑maps the flat vector codes of the FAISS file written by `vector_store.save_index()`
+     (FastScan IVF lists of the largest tier are still read into RAM). The Parquet metadata is read
+     from a mapped file, but the decoded DataFrame is private to each process.
+   • Falls back to the older single pickle file if no Parquet metadata sits next to it.
+   • Legacy pickles are served as‑is (no re‑indexing at startup); convert them once with
+     `vector_store.migrate_legacy_index()` to get the normalized index and memory‑mapped loading.
+   • Cached with `st.cache_resource`, so Streamlit reruns don't reload it.
+   • Returns two objects:
+       - `df_metadata` (pd.DataFrame) → original metadata text chunks + TABLE_NAME, COLUMN_NAME, ... for display
        - FAISS `index`  → performs similarity search
-       - `docs` (list[str]) → original metadata text chunks
-       - `paths` (list[list[str]]) → [[TABLE_NAME, COLUMN_NAME], ...] for display
 
-2. **semantic_search(query, k, index, docs, paths)**
-   • Embeds the user query using the same `embed()` helper.
+2. **configure_search(index)**
+   • Applies query‑time knobs (IVF `nprobe`, HNSW `efSearch`) that trade a little speed for recall.
+
+3. **move_to_gpu(index)**
+   • If FAISS sees a GPU, copies the index there (all GPUs if several); otherwise returns it unchanged.
+
+4. **metadata_arrays(df_metadata)**
+   • Plain numpy copies of the `doc` / `TABLE_NAME` / `COLUMN_NAME` columns, built once per DataFrame,
+     so search results are gathered with one fancy‑index instead of per‑row pandas lookups.
+   • Lives in `embedding_utils` (shared with its `search()`); imported here for `search_vectors`.
+
+5. **search_vectors(q_vecs, k, index, df_metadata)**
+   • One `index.search()` for a whole (B, d) batch of query vectors.
+   • Returns columns (`id`, `distance`, `doc`, `table`, `column`), each a (B, k) array – no per‑hit dicts.
+
+6. **semantic_search(query, k, index, df_metadata)**
+   • Embeds the user query using the same (memoized) `embed_query()` helper.
    • Runs `index.search()` to get the *k* closest vectors.
-   • Formats the results into a friendly list of dicts you can pass to the LLM.
+   • Returns the same columns as plain lists; `zip()` them if you need one record per hit.
+
+7. **QueryBatcher(index)**
+   • Drop‑in stand‑in for the index: `batcher.search(x, k)` returns `(D, I)` just like FAISS.
+   • Queries arriving from concurrent Streamlit sessions within a few ms are searched as one
+     matrix, so FAISS does one matrix‑matrix product instead of many matrix‑vector ones.
 """
 
+import os
 import pickle
+import queue
+import threading
+import time
+from concurrent.futures import Future
 import numpy as np
 from typing import Tuple, List, Dict
 import pandas as pd
 
 import faiss
-from embedding_utils import embed  # re‑use the same embedding model so vectors live in same space
+import streamlit as st
+from vector_store import metadata_path
+from embedding_utils import embed_query, as_query_batch, metadata_arrays  # re‑use the same embedding model so vectors live in same space
+
+SEARCH_NPROBE = 32     # IVF lists visited per query (ignored by flat indexes)
+SEARCH_EF_SEARCH = 64  # HNSW candidate list size per query: higher = better recall, slower
+
+_gpu_resources = None  # must outlive the GPU index that uses it
+
+BATCH_WINDOW = 0.010  # seconds QueryBatcher waits for more queries before searching
 
 # -----------------------------------------------------------------------------
 # 1. Load the stored index + metadata
 # -----------------------------------------------------------------------------
 
+@st.cache_resource(show_spinner=False)  # one copy per server process, reused across reruns and sessions
 def load_index(path="vector_index.faiss"):
     """
-    Load FAISS index and full metadata from pickle.
+    Load FAISS index and full metadata.
+    Cached by Streamlit, so callers share the same (read-only) objects.
 
     Returns:
         df_metadata (pd.DataFrame), index (faiss.Index)
     """
-    with open(path, "rb") as f:
-        data = pickle.load(f)
-        index = data["index"]
-        df_metadata = pd.DataFrame(data["metadata"])
-    
+    if os.path.exists(metadata_path(path)):
+        # MMAP_IFC maps flat code storage (the fp16 tier, HNSW's vectors, the Refine(Flat) vectors): those
+        # pages load on demand and are shared via the OS page cache across Streamlit worker processes.
+        # The FastScan IVF lists of the 1M+ tier (BlockInvertedLists) are NOT mapped and are still read
+        # into each process's memory; IO_FLAG_MMAP only affects ArrayInvertedLists, which
+        # build_faiss_index doesn't produce.
+        # memory_map=True only maps the zstd-compressed Parquet bytes (no read() copy of the file); each
+        # process still decompresses them into its own DataFrame, so the metadata is not shared.
+        index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        df_metadata = pd.read_parquet(metadata_path(path), memory_map=True)
+    else:
+        # Legacy format: one pickle holding {"index": ..., "metadata": {column: [values]}}.
+        # Its IndexFlatL2 over unit-length OpenAI vectors ranks like cosine, so it still works with
+        # normalized queries; only the score is a distance (lower = closer) instead of a similarity.
+        print(f"⚠️ {path} is a legacy pickle; run `python vector_store.py` once to migrate it")
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+            index = data["index"]
+            df_metadata = pd.DataFrame(data["metadata"])
+
+    configure_search(index)
+    index = move_to_gpu(index)
+    metadata_arrays(df_metadata)  # warm the column arrays used by semantic_search
     #print(f"📦 Loaded index from {path}")
     return df_metadata, index
 
+
+def configure_search(index):
+    """Set query‑time search parameters on the loaded index, whatever its type."""
+    ivf = faiss.try_extract_index_ivf(index)  # unwraps Refine / PreTransform wrappers
+    if ivf is not None:
+        ivf.nprobe = SEARCH_NPROBE
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = SEARCH_EF_SEARCH
+    return index
+
+
+def move_to_gpu(index):
+    """Copy the index to GPU(s) when available; queries are copied over transparently by FAISS."""
+    global _gpu_resources
+    ngpu = faiss.get_num_gpus()  # always 0 on faiss-cpu
+    if ngpu == 0:
+        return index
+    try:
+        if ngpu > 1:
+            return faiss.index_cpu_to_all_gpus(index)
+        if _gpu_resources is None:
+            _gpu_resources = faiss.StandardGpuResources()
+        return faiss.index_cpu_to_gpu(_gpu_resources, 0, index)
+    except RuntimeError as e:
+        # e.g. HNSW / RaBitQ have no GPU implementation → keep searching on CPU
+        print(f"⚠️ GPU copy failed, using CPU index: {e}")
+        return index
+
+
 # -----------------------------------------------------------------------------
 # 2. Semantic search given a user query
 # -----------------------------------------------------------------------------
 
-def semantic_search(query: str, k: int, index: faiss.Index, docs: List[str], paths: List[List[str]]) -> List[Dict]:
-    """Return top‑k matches: distance, doc text, table, column."""
-    q_vec = embed([query])[0]
-    D, I = index.search(np.array([q_vec]), k)
-    results = []
-    for dist, idx in zip(D[0], I[0]):
-        table, column = paths[idx]
-        results.append({
-            "distance": float(dist),
-            "doc": docs[idx],
-            "table": table,
-            "column": column,
-        })
+def search_vectors(q_vecs: np.ndarray, k: int, index: faiss.Index, df_metadata: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Top‑k matches for a (B, d) batch of unit‑length query vectors, as columns of shape (B, k).
+    Slots FAISS could not fill (fewer than k hits) have id = -1 and doc/table/column = None."""
+    D, I = index.search(as_query_batch(q_vecs), k)
+    found = I >= 0  # FAISS pads with -1 when fewer than k hits exist
+    ids = np.where(found, I, 0)
+    arrays = metadata_arrays(df_metadata)
+    results = {"id": I, "distance": D}
+    for key, col in (("doc", "doc"), ("table", "TABLE_NAME"), ("column", "COLUMN_NAME")):
+        gathered = arrays[col][ids]
+        gathered[~found] = None
+        results[key] = gathered
     return results
 
+
+def semantic_search(query: str, k: int, index: faiss.Index, df_metadata: pd.DataFrame) -> Dict[str, List]:
+    """Return top‑k matches as columns: row id, distance, doc text, table, column."""
+    q_vec = embed_query(query)
+    hits = search_vectors(q_vec, k, index, df_metadata)
+    found = hits["id"][0] >= 0
+    return {key: values[0][found].tolist() for key, values in hits.items()}
+
+# -----------------------------------------------------------------------------
+# 3. Coalesce concurrent searches into one batch
+# -----------------------------------------------------------------------------
+
+class QueryBatcher:
+    """Collects search requests from many threads and runs them as one `index.search()`."""
+
+    def __init__(self, index: faiss.Index, window: float = BATCH_WINDOW):
+        self.index = index
+        self.window = window
+        self._queue = queue.Queue()  # (queries, k, Future)
+        threading.Thread(target=self._run, name="faiss-query-batcher", daemon=True).start()
+
+    def search(self, x: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Same contract as `faiss.Index.search`; blocks until the batch containing `x` is done."""
+        x = as_query_batch(x)
+        future = Future()
+        self._queue.put((x, k, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]  # sleep until the first request arrives
+            deadline = time.monotonic() + self.window
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    pending.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            k_max = max(k for _, k, _ in pending)  # top‑k is a prefix of top‑k_max
+            try:
+                D, I = self.index.search(np.vstack([x for x, _, _ in pending]), k_max)
+            except Exception as e:
+                for _, _, future in pending:
+                    future.set_exception(e)
+                continue
+
+            row = 0
+            for x, k, future in pending:
+                future.set_result((D[row:row + len(x), :k], I[row:row + len(x), :k]))
+                row += len(x)
+
 # Example usage (remove or wrap under __name__ check in production)
 if __name__ == "__main__":
-    idx, docs_list, path_list = load_index()
-    hits = semantic_search("duplicate applications reason for decline", 3, idx, docs_list, path_list)
-    for h in hits:
+    df_meta, idx = load_index()
+    hits = semantic_search("duplicate applications reason for decline", 3, idx, df_meta)
+    for h in zip(hits["distance"], hits["table"], hits["column"]):
         print(h)
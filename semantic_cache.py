@@ -0,0 +1,81 @@
+# semantic_cache.py – Reuse answers for questions Marwin has already answered
+"""
+Why this file exists (layman explanation)
+========================================
+Users often ask the same thing twice in slightly different words ("where are approvals?"
+vs "which table has application approvals?"). Calling the LLM again costs a second or two.
+This module keeps a tiny FAISS index of *past query embeddings*; if a new query is almost
+identical in meaning (cosine similarity above a threshold) we hand back the stored answer.
+
+Only **stand‑alone questions** are cached. A follow‑up such as "what about rejections?" only
+makes sense together with the conversation before it, so the cache ignores chat history entirely:
+callers must check `is_follow_up(query)` and bypass the cache (no lookup, no add) when it is True.
+
+What the module offers
+----------------------
+**is_follow_up(query)**
+   • Heuristic: True if the question leans on earlier turns ("what about…", "it", "that table", …).
+
+**SemanticCache(dim, threshold, max_entries)**
+   • `q_vec` is a unit‑length query embedding from `embedding_utils.embed_query`.
+   • `lookup(q_vec)` → `(answer, top_matches)` of the closest past query, or `None` on a miss.
+   • `add(q_vec, answer, top_matches)` → remembers a freshly generated answer; once `max_entries`
+     answers are stored the oldest one is evicted (FIFO), so memory stays bounded.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from embedding_utils import as_query_batch
+
+SIMILARITY_THRESHOLD = 0.95  # cosine similarity needed to treat two queries as the same question
+MAX_ENTRIES = 1000           # ~6 KB per vector + answer; oldest entries are evicted beyond this
+
+# Openers and pronouns that point back at earlier turns ("what about …", "show me its columns")
+_FOLLOW_UP_START = re.compile(r"^\s*(what about|how about|and|also|then|same|ok|okay|so)\b", re.IGNORECASE)
+_FOLLOW_UP_WORDS = re.compile(
+    r"\b(it|its|that|those|these|this|they|them|their|same|above|previous|earlier|last one|one more)\b",
+    re.IGNORECASE,
+)
+
+
+def is_follow_up(query: str) -> bool:
+    """True if the query probably depends on the conversation history (so must not use the cache)."""
+    return bool(_FOLLOW_UP_START.search(query) or _FOLLOW_UP_WORDS.search(query))
+
+
+class SemanticCache:
+    """Bounded in‑memory FIFO cache of (query embedding → answer, top_matches) for stand‑alone questions."""
+
+    def __init__(self, dim: int = 1536, threshold: float = SIMILARITY_THRESHOLD, max_entries: int = MAX_ENTRIES):
+        self.index = faiss.IndexIDMap(faiss.IndexFlatIP(dim))  # unit vectors → inner product = cosine
+        self.entries: "OrderedDict[int, Tuple[str, List[Dict]]]" = OrderedDict()  # id → entry, oldest first
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._next_id = 0
+        self._lock = threading.Lock()  # shared across Streamlit sessions
+
+    def lookup(self, q_vec) -> Optional[Tuple[str, List[Dict]]]:
+        """Return the cached (answer, top_matches) for a near‑identical past query, else None."""
+        with self._lock:
+            if self.index.ntotal == 0:
+                return None
+            D, I = self.index.search(as_query_batch(q_vec), 1)
+            if D[0][0] < self.threshold:
+                return None
+            return self.entries[int(I[0][0])]
+
+    def add(self, q_vec, answer: str, top_matches: List[Dict]):
+        """Store a newly generated answer under its query embedding, evicting the oldest if full."""
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self.index.add_with_ids(as_query_batch(q_vec), np.array([entry_id], dtype="int64"))
+            self.entries[entry_id] = (answer, top_matches)
+            while len(self.entries) > self.max_entries:
+                oldest, _ = self.entries.popitem(last=False)
+                self.index.remove_ids(np.array([oldest], dtype="int64"))
@@ -3,51 +3,113 @@
 This file takes care of two core responsibilities:
 
 1. **Indexing**: It uses FAISS to index the embeddings of all metadata entries. This makes future similarity searches fast and efficient.
-2. **Persistence**: It saves both the FAISS index and associated metadata (like the original doc string and table/column path) using pickle, so that the index can be reloaded quickly without recomputing everything.
+2. **Persistence**: It saves the FAISS index in FAISS's native binary format and the associated metadata (like the original doc string and table/column path) as a Parquet file next to it, so that the index can be reloaded (memory-mapped) quickly without recomputing everything.
 
 Functions:
-- build_faiss_index(embeddings): Builds a FAISS index from a 2D numpy array of embeddings.
+- build_faiss_index(embeddings, kind): Builds a cosine-similarity FAISS index from a 2D numpy array of embeddings.
+  Small corpora get an exhaustive fp16 index, medium ones an HNSW graph, and very large ones a 4-bit FastScan
+  IVF-PQ index with exact reranking.
+  kind="rabitq" instead stores 1-bit RaBitQ codes (~32x smaller) and reranks with the full vectors.
 - save_index(index, df_metadata, filepath): Saves the FAISS index and associated metadata to disk.
+- metadata_path(filepath): Where the Parquet metadata for a given index file lives.
+- migrate_legacy_index(filepath): One-off conversion of an old pickled `IndexFlatL2` file into the current
+  normalized index + Parquet format (run `python vector_store.py`), so servers never re-index at startup.
 """
 
-import faiss
+import os
 import pickle
+import faiss
 import numpy as np
+import pandas as pd
+
+FLAT_INDEX_MAX_VECTORS = 10_000  # below this an exhaustive scan is cheap enough
+HNSW_MAX_VECTORS = 1_000_000     # below this an in-RAM HNSW graph (full float32 vectors) is affordable
+HNSW_M = 32                      # graph neighbours per node
+HNSW_EF_CONSTRUCTION = 200       # build-time search depth: better graph, slower build
+REFINE_K_FACTOR = 4              # PQ candidates re-scored with full vectors = k_factor * k
+RABITQ_K_FACTOR = 5              # 1-bit codes are coarser, so re-score a wider shortlist
 
-def build_faiss_index(embeddings):
+def build_faiss_index(embeddings, kind="auto"):
     """
     Create a FAISS index for fast vector similarity search.
 
+    Vectors are L2-normalized so inner product equals cosine similarity
+    (higher score = closer match).
+    - fewer than FLAT_INDEX_MAX_VECTORS rows → exhaustive scan over fp16 codes
+      (`IndexScalarQuantizer` QT_fp16): half the bytes of float32, negligible recall loss
+    - fewer than HNSW_MAX_VECTORS rows → `IndexHNSWFlat`: graph descent touches only
+      ~efSearch·log(N) vectors per query; no training needed
+    - otherwise → `IVF{nlist},PQ{dim/2}x4fs,Refine(Flat)`: 4-bit FastScan codes scanned
+      with SIMD lookup tables, then the top `REFINE_K_FACTOR * k` hits are re-ranked
+      against the stored float32 vectors to recover recall
+    - kind="rabitq" → `RaBitQ,Refine(Flat)`: 1 bit per dimension (192 bytes for 1536 dims),
+      top `RABITQ_K_FACTOR * k` hits re-ranked against the float32 vectors
+
     Args:
         embeddings (np.ndarray): 2D array where each row is an embedding vector.
+        kind (str): "auto" (pick by corpus size) or "rabitq".
 
     Returns:
         faiss.Index: Indexed FAISS object.
     """
-    dim = embeddings.shape[1]  # e.g., 1536 for OpenAI embeddings
-    index = faiss.IndexFlatL2(dim)
+    embeddings = np.array(embeddings, dtype="float32", order="C")  # copy: normalize_L2 works in place
+    faiss.normalize_L2(embeddings)
+    n, dim = embeddings.shape  # e.g., dim = 1536 for OpenAI embeddings
+
+    if kind == "rabitq":
+        index = faiss.index_factory(dim, "RaBitQ,Refine(Flat)", faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+        index.k_factor = RABITQ_K_FACTOR
+    elif kind != "auto":
+        raise ValueError(f"Unknown index kind: {kind!r}")
+    elif n < FLAT_INDEX_MAX_VECTORS:
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)  # no-op for fp16, kept so swapping in QT_8bit just works
+    elif n < HNSW_MAX_VECTORS:
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    else:
+        nlist = int(4 * np.sqrt(n))
+        index = faiss.index_factory(dim, f"IVF{nlist},PQ{dim // 2}x4fs,Refine(Flat)", faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+        index.k_factor = REFINE_K_FACTOR
     index.add(embeddings)
     print("✅ vectors indexed:", index.ntotal)
     return index
 
 
+def metadata_path(filepath):
+    """vector_index.faiss → vector_index.parquet"""
+    return os.path.splitext(filepath)[0] + ".parquet"
+
+
 def save_index(index, df_metadata, filepath="vector_index.faiss"):
     """
-    Save the FAISS index and full metadata using pickle.
+    Save the FAISS index (native format) and full metadata (Parquet, zstd-compressed).
 
     Args:
         index (faiss.Index): Trained FAISS index object.
         df_metadata (pd.DataFrame): Must include all relevant metadata fields used in prompting.
-        filepath (str): File path to save the index and metadata.
+        filepath (str): File path for the index; metadata goes to `metadata_path(filepath)`.
         
     """
-    with open(filepath, "wb") as f:
-        pickle.dump({
-            "index": index,
-            "metadata": df_metadata.to_dict(orient="list")  # Save all columns
-        }, f)
-    print(f"💾 Saved full index and metadata to {filepath}")
+    faiss.write_index(index, filepath)
+    df_metadata.to_parquet(metadata_path(filepath), compression="zstd")  # Save all columns
+    print(f"💾 Saved index to {filepath} and metadata to {metadata_path(filepath)}")
+
 
+def migrate_legacy_index(filepath="vector_index.faiss"):
+    """
+    Convert a legacy pickle ({"index": IndexFlatL2, "metadata": {column: [values]}}) in place:
+    the stored vectors are re-indexed with build_faiss_index (normalized, cosine) and written
+    with save_index. Run once per index file; load_index then reads the native files directly.
+    """
+    with open(filepath, "rb") as f:
+        data = pickle.load(f)
+    old_index = data["index"]
+    index = build_faiss_index(old_index.reconstruct_n(0, old_index.ntotal))
+    save_index(index, pd.DataFrame(data["metadata"]), filepath)
 
 
-    
+if __name__ == "__main__":
+    migrate_legacy_index()